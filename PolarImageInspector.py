@@ -17,13 +17,71 @@ from PyQt5.QtWidgets import (
     QPushButton,
 )
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, QTimer
 import qdarktheme
-from Wamos2.polar_image import PolarImage
-from PIL import Image
-import json
 import pathlib
 
+LOCATION_KEYS = ("LAT", "LONG")
+GENERAL_KEYS = (
+    "OWNER",
+    "VINFO",
+    "VERSN",
+    "TOWER",
+    "IDENT",
+    "USER",
+    "DATE",
+    "TIME",
+    "ZONE",
+)
+TECHNICAL_KEYS = (
+    "TMINT",
+    "NMEAN",
+    "ANALM",
+    "AMINT",
+    "NIPOL",
+    "NUMRE",
+    "RPT",
+    "SDRNG",
+    "SFREQ",
+    "FIFO",
+    "BO2RA",
+    "HDGDL",
+    "GYROC",
+    "GYROV",
+    "VGAIN",
+    "CMPOFF",
+)
+ENVIRONMENTAL_KEYS = (
+    "WDEPF",
+    "P_DEP",
+    "PDEPV",
+    "SHIPR",
+    "SHIRV",
+    "SHIPS",
+    "SHISV",
+    "SPTWL",
+    "SPWLV",
+    "SPTWT",
+    "SPWTV",
+    "WINDS",
+    "WINSV",
+    "WINDR",
+    "WINRV",
+    "WINDT",
+    "WINDH",
+    "WATSP",
+    "WATSV",
+)
+ADDITIONAL_KEYS = ("DABIT", "F0001", "RPM", "EOH")
+
+# Group name, keys and number of grid columns (None for box layouts)
+_KEY_GROUPS = (
+    ("location", LOCATION_KEYS, 2),
+    ("technical", TECHNICAL_KEYS, None),
+    ("environmental", ENVIRONMENTAL_KEYS, 5),
+    ("additional", ADDITIONAL_KEYS, None),
+)
+
 
 class PolarImageInspector(QMainWindow):
     def __init__(self):
@@ -32,6 +90,9 @@ class PolarImageInspector(QMainWindow):
         self.polarImage = None
         self.data_dict = {}
         self.pixmap = None
+        self._scaled_cache = (None, None, None)  # (w, h, pixmap)
+        # Key and value widgets per group, created once and reused on every open
+        self._pool = {group: {} for group, _, _ in _KEY_GROUPS}
 
         self.initUI()
 
@@ -44,6 +105,11 @@ class PolarImageInspector(QMainWindow):
         self.image_label.setAlignment(Qt.AlignCenter)
         self.resizeEvent = self.customResizeEvent
 
+        # Coalesce bursts of resize events into a single rescale
+        self._resize_timer = QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.timeout.connect(self._do_rescale)
+
         # Create a menu bar
         menubar = self.menuBar()
 
@@ -152,6 +218,9 @@ class PolarImageInspector(QMainWindow):
         self.setCentralWidget(final_widget)
 
     def open_image(self):
+        # Imported on first open so the window shows up without loading the parser
+        from Wamos2.polar_image import PolarImage, read_metadata
+
         # Open a file dialog to choose an image file
         file_dialog = QFileDialog(self)
         file_path, _ = file_dialog.getOpenFileName(
@@ -167,16 +236,18 @@ class PolarImageInspector(QMainWindow):
             if ext == ".pol":
                 self.polarImage = PolarImage(file_path)
                 self.data_dict = self.polarImage.header
-                png_path = str(self.polarImage.saveto("temp/temp.png"))
+                png_path = str(
+                    self.polarImage.saveto("temp/temp.png", size=self._max_image_size())
+                )
                 self.pixmap = QPixmap(png_path)
             elif ext == ".png":
-                with Image.open(file_path) as img:
-                    self.pixmap = QPixmap(file_path)
-                    self.data_dict = json.loads(img.text["json_data"])
+                self.pixmap = QPixmap(file_path)
+                self.data_dict = read_metadata(file_path)
             else:
                 self.pixmap = QPixmap(file_path)
 
             # Resize the image to fit the window height while maintaining the aspect ratio
+            self._scaled_cache = (None, None, None)
             pixmap = self.scale_image_to_window(self.pixmap)
 
             # Set the pixmap to the QLabel
@@ -188,157 +259,129 @@ class PolarImageInspector(QMainWindow):
             # Add new key-value pairs
             self.add_key_value_pairs(self.data_dict)
 
-    def scale_image_to_window(self, pixmap):
-        # Get the current window height
+    def _target_size(self):
+        # Get the current window size, the image takes half of it
         height = self.centralWidget().height()
         width = self.centralWidget().width()
+        return width // 2, height // 2
+
+    def _max_image_size(self):
+        # The image never takes more than half of the screen, so render it no larger
+        screen = self.screen().availableGeometry()
+        return min(screen.width(), screen.height()) // 2
+
+    def scale_image_to_window(self, pixmap, smooth: bool = True):
+        tw, th = self._target_size()
+        # Reuse the last smooth result if the target size has not changed
+        if smooth and (tw, th) == self._scaled_cache[:2]:
+            return self._scaled_cache[2]
+
         # Scale the image to fit the window height while maintaining the aspect ratio
-        return pixmap.scaled(
-            width//2, height//2, Qt.KeepAspectRatio, Qt.SmoothTransformation
-        )
+        transformation = Qt.SmoothTransformation if smooth else Qt.FastTransformation
+        result = pixmap.scaled(tw, th, Qt.KeepAspectRatio, transformation)
+        if smooth:
+            self._scaled_cache = (tw, th, result)
+        return result
 
     def customResizeEvent(self, event):
-        # Resize the image when the window size changes
-        if self.polarImage:
-            pixmap = self.image_label.pixmap()
-            if self.pixmap:
-                pixmap = self.scale_image_to_window(self.pixmap)
-                self.image_label.setPixmap(pixmap)
+        # Use a fast rescale while resizing, the smooth one runs once it stops
+        if self.polarImage and self.pixmap:
+            if self._target_size() == self._scaled_cache[:2]:
+                return super().resizeEvent(event)
+            pixmap = self.scale_image_to_window(self.pixmap, smooth=False)
+            self.image_label.setPixmap(pixmap)
+            self._resize_timer.start(150)
 
         # Call the base class implementation
         super().resizeEvent(event)
 
+    def _do_rescale(self):
+        if self.pixmap:
+            pixmap = self.scale_image_to_window(self.pixmap)
+            self.image_label.setPixmap(pixmap)
+
     def add_key_value_pairs(self, data_dict):
-        location_keys = ["LAT", "LONG"]
-        general_keys = [
-            "OWNER",
-            "VINFO",
-            "VERSN",
-            "TOWER",
-            "IDENT",
-            "USER",
-            "DATE",
-            "TIME",
-            "ZONE",
-        ]
-        technical_keys = [
-            "TMINT",
-            "NMEAN",
-            "ANALM",
-            "AMINT",
-            "NIPOL",
-            "NUMRE",
-            "RPT",
-            "SDRNG",
-            "SFREQ",
-            "FIFO",
-            "BO2RA",
-            "HDGDL",
-            "GYROC",
-            "GYROV",
-            "VGAIN",
-            "CMPOFF",
-        ]
-        environmental_keys = [
-            "WDEPF",
-            "P_DEP",
-            "PDEPV",
-            "SHIPR",
-            "SHIRV",
-            "SHIPS",
-            "SHISV",
-            "SPTWL",
-            "SPWLV",
-            "SPTWT",
-            "SPWTV",
-            "WINDS",
-            "WINSV",
-            "WINDR",
-            "WINRV",
-            "WINDT",
-            "WINDH",
-            "WATSP",
-            "WATSV",
-        ]
-        additional_keys = ["DABIT", "F0001", "RPM", "EOH"]
-
-        # Add general information
-        general_info_text = ""
-        for key in general_keys:
-            if key in data_dict:
-                value = data_dict[key]
-                general_info_text += f"<b>{key}:</b> {value['value']}   "
-        self.general_info_label.setText(general_info_text)
-
-        # Add location information
-        row, col = 0, 0
-        for key in location_keys:
-            if key in data_dict:
-                value = data_dict[key]
-                key_label = QLabel(key)
-                value_textbox = QLineEdit(str(value["value"]))
-                value_textbox.setReadOnly(True)
-                value_textbox.setToolTip(value["description"])
-                self.location_layout.addWidget(key_label, row, col * 2)
-                self.location_layout.addWidget(value_textbox, row, col * 2 + 1)
-                col += 1
-                if col >= 2:
-                    col = 0
-                    row += 1
-
-        # Add technical information
-        for key in technical_keys:
-            if key in data_dict:
-                value = data_dict[key]
-                key_label = QLabel(key)
-                value_textbox = QLineEdit(str(value["value"]))
-                value_textbox.setReadOnly(True)
-                value_textbox.setToolTip(value["description"])
-                technical_group = QGroupBox(key)
+        # Suspend repaints while the widgets are being placed
+        self.setUpdatesEnabled(False)
+        try:
+            # Add general information
+            general_info_text = "".join(
+                f"<b>{key}:</b> {data_dict[key]['value']}   "
+                for key in GENERAL_KEYS
+                if key in data_dict
+            )
+            self.general_info_label.setText(general_info_text)
+
+            # Add location, technical, environmental and additional information
+            for group, keys, columns in _KEY_GROUPS:
+                layout = getattr(self, f"{group}_layout")
+                row, col = 0, 0
+                for key in keys:
+                    value = data_dict.get(key)
+                    if value is None:
+                        continue
+
+                    key_widget, value_textbox = self._pooled_widgets(group, key, value)
+                    if group == "technical":
+                        # The value text box lives inside the technical group box
+                        widgets = (key_widget,)
+                    else:
+                        widgets = (key_widget, value_textbox)
+
+                    if columns:
+                        layout.addWidget(key_widget, row, col * 2)
+                        layout.addWidget(value_textbox, row, col * 2 + 1)
+                        col += 1
+                        if col >= columns:
+                            col = 0
+                            row += 1
+                    else:
+                        for widget in widgets:
+                            layout.addWidget(widget)
+
+                    # Pooled widgets were hidden on clear, show them once they are back in place
+                    for widget in widgets:
+                        widget.setVisible(True)
+
+            # Lay everything out once and repaint
+            self.centralWidget().layout().activate()
+        finally:
+            self.setUpdatesEnabled(True)
+
+    def _pooled_widgets(self, group, key, value):
+        # Create the widgets for a key the first time it is shown
+        pool = self._pool[group]
+        if key not in pool:
+            value_textbox = QLineEdit()
+            value_textbox.setReadOnly(True)
+            if group == "technical":
+                key_widget = QGroupBox(key)
                 technical_layout = QVBoxLayout()
                 technical_layout.addWidget(value_textbox)
-                technical_group.setLayout(technical_layout)
-                self.technical_layout.addWidget(technical_group)
-
-        # Add environmental information
-        row, col = 0, 0
-        for key in environmental_keys:
-            if key in data_dict:
-                value = data_dict[key]
-                key_label = QLabel(key)
-                value_textbox = QLineEdit(str(value["value"]))
-                value_textbox.setReadOnly(True)
-                value_textbox.setToolTip(value["description"])
-                self.environmental_layout.addWidget(key_label, row, col * 2)
-                self.environmental_layout.addWidget(value_textbox, row, col * 2 + 1)
-                col += 1
-                if col >= 5:
-                    col = 0
-                    row += 1
-
-        # Add additional information
-        for key in additional_keys:
-            if key in data_dict:
-                value = data_dict[key]
-                key_label = QLabel(key)
-                value_textbox = QLineEdit(str(value["value"]))
-                value_textbox.setReadOnly(True)
-                value_textbox.setToolTip(value["description"])
-                self.additional_layout.addWidget(key_label)
-                self.additional_layout.addWidget(value_textbox)
+                key_widget.setLayout(technical_layout)
+            else:
+                key_widget = QLabel(key)
+            pool[key] = (key_widget, value_textbox)
+
+        # Update the existing widgets with the new value
+        key_widget, value_textbox = pool[key]
+        value_textbox.setText(str(value["value"]))
+        value_textbox.setToolTip(value["description"])
+        return key_widget, value_textbox
 
     def clear_key_value_pairs(self):
-        # Clear existing key-value pairs from the layouts
+        # Clear existing key-value pairs from the layouts, the widgets stay pooled
         for layout in [
             self.location_layout,
             self.technical_layout,
             self.environmental_layout,
             self.additional_layout,
         ]:
-            while layout.count():
-                item = layout.takeAt(0)
+            # Take items from the end so Qt does not shift the remaining ones
+            for i in reversed(range(layout.count())):
+                item = layout.takeAt(i)
                 if item.widget():
-                    item.widget().deleteLater()
+                    item.widget().hide()
 
     def save_image(self):
         # Opens a dialog for saving a file
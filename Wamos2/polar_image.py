@@ -1,17 +1,100 @@
 # https://www.yumpu.com/en/document/read/49205057/wamos-ii-manual
 
+import functools
 import io
+import mmap
 from loguru import logger
 import pathlib
+import re
+import struct
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.colors import Normalize
-from scipy.interpolate import griddata
-from PIL import PngImagePlugin, Image
 import json
 
+# matplotlib, scipy and PIL are slow to import, so they are imported where they are used
+
 logger.add("Output/log.log", rotation="1 week")
 
+# Header line: "KEY VALUE [CC DESCRIPTION]", skipping comment lines
+_HEADER_LINE = re.compile(r"^(?!CC|\*\*) ?(\S+) (?=\S)(.*?)(?:(CC)(.*?))? ?\r?$", re.M)
+_WHITESPACE = re.compile(r"[^\S\r\n]+")
+_INTEGER = re.compile(r"\d+")
+
+
+@functools.lru_cache(maxsize=8)
+def _polar_grid(rays: int, pixels: int):
+    """
+    Builds the (theta, r) mesh used by render() for a given image shape.
+
+    The arrays are cached and shared between calls, so they are returned read-only.
+
+    Args:
+        rays (int): The number of rays, spread evenly over 0 to 2pi.
+        pixels (int): The number of samples along each ray, including the padding.
+
+    Returns:
+        tuple: The theta and r meshes, both of shape (pixels, rays).
+    """
+    rays_angles = np.linspace(0, (2 * np.pi), rays, endpoint=True)
+    pixel_positions = np.arange(0, pixels)
+
+    theta, r = np.meshgrid(rays_angles, pixel_positions)
+    theta.flags.writeable = False
+    r.flags.writeable = False
+
+    return theta, r
+
+
+@functools.lru_cache(maxsize=2)
+def _raster_grid(size: int, samples: int):
+    """
+    Computes the orientation independent part of the raster to polar mapping.
+
+    Entries are shared by every file with the same shape, so callers must not modify them.
+
+    Args:
+        size (int): The width and height of the raster in pixels.
+        samples (int): The number of samples along each ray.
+
+    Returns:
+        tuple: The screen angle of every pixel, its sample index and a mask of pixels outside the circle.
+    """
+    centre = (size - 1) / 2
+    xs, ys = np.meshgrid(np.arange(size) - centre, centre - np.arange(size))
+
+    r = np.hypot(xs, ys) / (size / 2)
+    angle = np.arctan2(ys, xs)
+    sample_idx = np.clip(np.rint(r * (samples - 1)), 0, samples - 1).astype(np.int32)
+
+    grid = (angle, sample_idx, r > 1)
+    for array in grid:
+        array.flags.writeable = False
+
+    return grid
+
+
+def _remap_indices(rays: int, samples: int, size: int, offset: float, direction: int):
+    """
+    Maps every pixel of a square raster to the nearest (ray, sample) of a polar grid.
+
+    Args:
+        rays (int): The number of rays, spread evenly over 0 to 2pi.
+        samples (int): The number of samples along each ray.
+        size (int): The width and height of the raster in pixels.
+        offset (float): The screen angle of ray 0, in radians counter-clockwise from east.
+        direction (int): 1 for counter-clockwise rays, -1 for clockwise.
+
+    Returns:
+        tuple: The ray indices, the sample indices and a mask of pixels outside the circle.
+    """
+    angle, sample_idx, outside = _raster_grid(size, samples)
+
+    # Orientation changes from file to file, so it is applied on every call
+    theta = np.mod(direction * (angle - offset), 2 * np.pi)
+    ray_idx = np.clip(np.rint(theta / (2 * np.pi) * (rays - 1)), 0, rays - 1)
+
+    return ray_idx.astype(np.intp), sample_idx, outside
+
+
 class PolarImage:
     def __init__(self, file_path: str):
         """
@@ -26,7 +109,18 @@ class PolarImage:
         self.header: dict = {}
         self.image_data = None
         self.eoh: int = None
+        self._file_map = None
 
+        try:
+            self._load()
+        finally:
+            # image_array is a copy, so the file does not need to stay mapped
+            self._release_file()
+
+    def _load(self):
+        """
+        Reads the header and the image array from the file.
+        """
         try:
             header_content, image_content = self._process_file()
         except Exception as e:
@@ -55,6 +149,26 @@ class PolarImage:
 
         logger.info(f"Processed {self.file_path.stem}")
 
+    def _release_file(self):
+        """
+        Drops the image data view and closes the file mapping opened by _process_file().
+
+        get_image_array() reads the image from disk once this has run.
+
+        Keeping the mapping open would lock the .pol file on Windows for as long as
+        this object lives.
+        """
+        if isinstance(self.image_data, memoryview):
+            self.image_data.release()
+        self.image_data = None
+
+        if self._file_map is not None:
+            try:
+                self._file_map.close()
+            except BufferError as e:
+                logger.warning(f"Could not close the file mapping: {e}")
+            self._file_map = None
+
     def _process_file(self):
         """
         Processes the file to separate header and image content.
@@ -64,9 +178,11 @@ class PolarImage:
                 Returns (None, None) if the EOH marker is not found.
         """
         try:
+            # Map the file so only the pages that are actually read get loaded
             with open(self.file_path, "rb") as file:
-                content = file.read()
-        except IOError as e:
+                content = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._file_map = content
+        except (IOError, ValueError) as e:
             logger.critical(f"Error opening or reading the file: {e}")
             return None, None
 
@@ -77,65 +193,41 @@ class PolarImage:
             return None, None
 
         # Find the end of header (EOH) by looking for the line ending after the EOH marker
-        eoh_end_index = eoh_index + content[eoh_index:].find(b"\r\n") + 2
+        eoh_end_index = content.find(b"\r\n", eoh_index) + 2
 
         self.eoh = eoh_end_index
 
-        header_content = content[: self.eoh]
-        image_content = content[self.eoh :]
+        # Slice through a memoryview so neither part is copied
+        view = memoryview(content)
+        header_content = view[: self.eoh]
+        image_content = view[self.eoh :]
 
         return header_content, image_content
 
-    def _process_header(self, header_content: bytes) -> dict:
+    def _process_header(self, header_content: memoryview) -> dict:
         """
         Processes the header content and extracts key-value pairs.
 
         Args:
-            header_content (bytes): The header content in bytes.
+            header_content (memoryview): The header content in bytes.
 
         Returns:
             dict: A dictionary containing the header information.
         """
-        header_dict = {}
-        desc_not_found = []
+        # Decode once and collapse runs of whitespace within each line
+        text = _WHITESPACE.sub(" ", str(header_content, "latin1"))
 
-        # Split the header content by lines and remove the last empty line if exists
-        header_lines = header_content.split(b"\r\n")[:-1]
+        # Comment lines starting with 'CC' or '**' and lines without a value never match
+        matches = _HEADER_LINE.findall(text)
 
-        for line in header_lines:
-            # Skip comment lines starting with 'CC' or '**'
-            if line.startswith((b"CC", b"**")):
-                continue
-
-            try:
-                text = line.decode("latin1")
-                text = " ".join(text.split())  # Remove extra spaces
-                key, value = text.split(
-                    " ", maxsplit=1
-                )  # Divide string into key and value
-
-                if not value:  # Skip if value is empty
-                    continue
-
-                cc_index = value.find("CC")
-
-                if cc_index != -1:  # If comment is found in the value
-                    new_value = value[:cc_index].strip()
-                    description = value[cc_index + 2 :].strip()
-                    header_dict[key] = {
-                        "value": self.auto_type(new_value),
-                        "description": description,
-                    }
-                else:
-                    desc_not_found.append(key)
-                    header_dict[key] = {
-                        "value": self.auto_type(value.strip()),
-                        "description": "N/A",
-                    }
-
-            except ValueError as e:
-                misc = line.decode("latin1").split(" ", maxsplit=1)
-                logger.debug(f"Found no value, skipping: {misc}. Error: {e}")
+        header_dict = {
+            key: {
+                "value": self.auto_type(value.strip()),
+                "description": description.strip() if cc else "N/A",
+            }
+            for key, value, cc, description in matches
+        }
+        desc_not_found = [key for key, _, cc, _ in matches if not cc]
 
         # Add the EOH value to the header dictionary
         header_dict["EOH"] = {"value": self.eoh, "description": "End of Header character position"}
@@ -143,19 +235,20 @@ class PolarImage:
         logger.debug(
             f"Could not find description for the following keys in Polar Image file: {desc_not_found}."
         )
-        logger.debug("Header created successfully.")
+        # One summary instead of logging every converted value
+        logger.debug(f"Header created successfully with {len(header_dict)} keys.")
 
         return header_dict
 
-    def _process_image(self, image_content: bytes) -> bytes:
+    def _process_image(self, image_content: memoryview) -> memoryview:
         """
         Processes the image content to extract the actual image data.
 
         Args:
-            image_content (bytes): The image content in bytes.
+            image_content (memoryview): The image content in bytes.
 
         Returns:
-            bytes: The extracted image data.
+            memoryview: The extracted image data.
         """
         try:
             # Determine the size of the image
@@ -173,12 +266,12 @@ class PolarImage:
             logger.critical(f"Error processing image content: {e}")
             return b""
 
-    def get_image_size(self, image_content: bytes) -> int:
+    def get_image_size(self, image_content: memoryview) -> int:
         """
         Determines the size of the image from the image content.
 
         Args:
-            image_content (bytes): The image content in bytes.
+            image_content (memoryview): The image content in bytes.
 
         Returns:
             int: The size of the image.
@@ -189,7 +282,7 @@ class PolarImage:
 
             # Extract and return the image size
             image_size = int(
-                image_content[:chars_describing_image_bytes].decode("latin1")
+                str(image_content[:chars_describing_image_bytes], "latin1")
             )
             return image_size
 
@@ -253,26 +346,20 @@ class PolarImage:
             any: The converted value with its correct data type, or the original string if conversion fails.
         """
         # Attempt to convert to integer
-        if string.isdigit():
-            logger.debug(f'Converted "{string}" to type {type(int(string))}.')
+        if _INTEGER.fullmatch(string):
             return int(string)
 
         # Attempt to convert to float
         try:
-            float_val = float(string)
-            logger.debug(f'Converted "{string}" to type {type(float_val)}.')
-            return float_val
+            return float(string)
         except ValueError:
             pass
 
         # Attempt to convert to boolean
         if string.lower() in ["true", "false"]:
-            bool_val = string.lower() == "true"
-            logger.debug(f'Converted "{string}" to type {type(bool_val)}.')
-            return bool_val
+            return string.lower() == "true"
 
         # Return the original string if no conversion was possible
-        logger.debug(f'Returning original string "{string}".')
         return string
 
     def get_image_array(self) -> np.ndarray:
@@ -298,16 +385,22 @@ class PolarImage:
                 logger.error(f"Unsupported DABIT value: {dabit_value}")
                 return np.array([])
 
-            # Reshape the image data to form the image array
-            image_array = (
-                np.frombuffer(self.image_data, dtype=dtype)
-                .copy()
-                .reshape((no_of_rays, no_of_samples_in_range))
-            )
+            if self.image_data is not None:
+                raw_data = np.frombuffer(self.image_data, dtype=dtype)
+            else:
+                # The file mapping is closed after construction, read the image from disk
+                raw_data = np.fromfile(
+                    self.file_path, dtype=dtype, offset=self.eoh + 10
+                )
+
+            # Reshape the image data to form the image array, this is a read-only view
+            raw_array = raw_data.reshape((no_of_rays, no_of_samples_in_range))
 
-            # Apply mask if needed
+            # Apply mask if needed, masking out-of-place allocates the only writable copy
             if mask is not None:
-                image_array &= mask
+                image_array = np.bitwise_and(raw_array, dtype(mask))
+            else:
+                image_array = raw_array.copy()
 
             # Set the first byte of each ray to zero for 8-bit data
             if dabit_value == 8:
@@ -324,48 +417,25 @@ class PolarImage:
         """
         Interpolates the image data to a finer grid resolution.
         """
+        from scipy.ndimage import zoom
+
         try:
-            # Original grid dimensions
-            data = self.image_array
-            num_rows, num_cols = data.shape
-
-            # Original grid points
-            original_x = np.linspace(0, 1, num_cols)
-            original_y = np.linspace(0, 1, num_rows)
-
-            # Target grid - increase resolution
-            fine_x = np.linspace(0, 1, num_cols * 2)
-            fine_y = np.linspace(0, 1, num_rows * 2)
-
-            # Create meshgrids for original and fine resolutions
-            original_x_mesh, original_y_mesh = np.meshgrid(original_x, original_y)
-            fine_x_mesh, fine_y_mesh = np.meshgrid(fine_x, fine_y)
-
-            # Interpolate data to the finer grid
-            fine_data = griddata(
-                (original_x_mesh.ravel(), original_y_mesh.ravel()),
-                data.ravel(),
-                (fine_x_mesh, fine_y_mesh),
-                method=method,
-            )  # Can try 'linear' or 'nearest'
-            self.image_array = fine_data
+            # Spline order for each method, 'cubic' can be swapped for 'linear' or 'nearest'
+            order = {"nearest": 0, "linear": 1, "cubic": 3}[method]
+
+            # Double the resolution along both axes, 'nearest' keeps the input dtype like griddata
+            output = None if order == 0 else np.float64
+            self.image_array = zoom(self.image_array, 2, output=output, order=order)
 
         except Exception as e:
             logger.critical(f"Error interpolating image data: {e}")
 
-    def render(
-        self, orient: bool = True, toggle_direction: bool = True, cmap: str = "Greys_r"
-    ):
+    def _blind_range(self) -> tuple:
         """
-        Renders the polar image with optional orientation and direction settings.
-
-        Args:
-            orient (bool): Whether to orient the image based on the header information.
-            toggle_direction (bool): Whether to toggle the direction of the plot.
-            cmap (str): The colormap to use for rendering.
+        Computes the number of samples hidden by the sampling delay and the value used to fill them.
 
         Returns:
-            matplotlib.figure.Figure: The rendered polar image figure.
+            tuple: The number of pixels to omit and the highest brightness value.
         """
         sampling_frequency = int(self.get("SFREQ"))
         sampling_delay_range = int(self.get("SDRNG"))
@@ -382,25 +452,43 @@ class PolarImage:
         else:
             HIGHEST_BRIGHTNESS = 255
 
+        return pixels_to_omit, HIGHEST_BRIGHTNESS
+
+    def render(
+        self, orient: bool = True, toggle_direction: bool = True, cmap: str = "Greys_r"
+    ):
+        """
+        Renders the polar image with optional orientation and direction settings.
+
+        Args:
+            orient (bool): Whether to orient the image based on the header information.
+            toggle_direction (bool): Whether to toggle the direction of the plot.
+            cmap (str): The colormap to use for rendering.
+
+        Returns:
+            matplotlib.figure.Figure: The rendered polar image figure.
+        """
+        import matplotlib.pyplot as plt
+        from matplotlib.colors import Normalize
+
+        pixels_to_omit, HIGHEST_BRIGHTNESS = self._blind_range()
+
+        # Pad a local copy in the image's own dtype, self.image_array is left untouched
         additional_columns = pixels_to_omit
         new_columns = np.full(
-            (self.image_array.shape[0], additional_columns), HIGHEST_BRIGHTNESS
-        )
-        self.image_array = np.concatenate((new_columns, self.image_array), axis=1)
-
-        rays_angles = np.linspace(
-            0, (2 * np.pi), self.image_array.shape[0], endpoint=True
+            (self.image_array.shape[0], additional_columns),
+            HIGHEST_BRIGHTNESS,
+            dtype=self.image_array.dtype,
         )
-        pixel_positions = np.arange(0, self.image_array.shape[1])
+        padded = np.concatenate((new_columns, self.image_array), axis=1)
 
-        theta, r = np.meshgrid(rays_angles, pixel_positions)
+        theta, r = _polar_grid(*padded.shape)
 
-        plt.figure(figsize=(4, 4))
-        fig, ax = plt.subplots(subplot_kw={"projection": "polar"})
+        fig, ax = plt.subplots(figsize=(4, 4), subplot_kw={"projection": "polar"})
         ax.pcolormesh(
             theta,
             r,
-            self.image_array.T,
+            padded.T,
             cmap=cmap,
             norm=Normalize(0, 4095),
             shading="gouraud",
@@ -424,17 +512,62 @@ class PolarImage:
         plt.close(fig)
         return fig
 
-    def saveto(self, output_path=None, file_extension: str = ".png"):
+    def render_image(
+        self, orient: bool = True, toggle_direction: bool = True, size: int = 1024
+    ) -> np.ndarray:
+        """
+        Renders the polar image directly to a greyscale raster, without matplotlib.
+
+        Every output pixel is mapped back to its (ray, sample) position and looked up
+        in the image array, matching the geometry of render().
+
+        Args:
+            orient (bool): Whether to orient the image based on the header information.
+            toggle_direction (bool): Whether to toggle the direction of the plot.
+            size (int): The width and height of the rendered image in pixels.
+
+        Returns:
+            np.ndarray: The rendered image as a (size, size) uint8 array.
+        """
+        pixels_to_omit, HIGHEST_BRIGHTNESS = self._blind_range()
+
+        direction = -1 if toggle_direction else 1
+        if orient:
+            offset = -float(np.deg2rad(int(2 * self.get("BO2RA"))))
+        else:
+            offset = np.pi / 2
+
+        no_of_rays, no_of_samples = self.image_array.shape
+        ray_idx, sample_idx, outside = _remap_indices(
+            no_of_rays, pixels_to_omit + no_of_samples, size, offset, direction
+        )
+
+        # Samples inside the blind range are drawn at the highest brightness
+        sample_idx = sample_idx - pixels_to_omit
+        blind = sample_idx < 0
+        values = self.image_array[ray_idx, np.maximum(sample_idx, 0)]
+        values = np.where(blind, HIGHEST_BRIGHTNESS, values)
+
+        # Same normalisation as render(), mapped to 8-bit grey
+        out = np.rint(np.clip(values, 0, 4095) * (255 / 4095)).astype(np.uint8)
+        out[outside] = 255
+
+        return out
+
+    def saveto(self, output_path=None, file_extension: str = ".png", size: int = 1024):
         """
         Saves the rendered polar image to a file.
 
         Args:
             output_path (str): The path where the image should be saved. If None, a default path will be used.
             file_extension (str): The file extension for the saved image.
+            size (int): The width and height of the saved image in pixels.
 
         Returns:
             str: The path where the image was saved.
         """
+        from PIL import Image
+
         if not output_path:
             new_path = self.file_path.relative_to(self.file_path.parent.parent)
             output_path = pathlib.Path("Output", new_path).with_suffix(file_extension)
@@ -443,9 +576,8 @@ class PolarImage:
             output_path = pathlib.Path(output_path)
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
-        self.render(orient=True, toggle_direction=False).savefig(
-            output_path, dpi=300, bbox_inches="tight"
-        )
+        image = self.render_image(orient=True, toggle_direction=False, size=size)
+        Image.fromarray(image).save(output_path)
 
         return str(output_path)
 
@@ -457,7 +589,10 @@ class PolarImage:
             output_path (str): The path where the image should be saved. If None, a default path will be used.
             file_extension (str): The file extension for the saved image.
 
+        The metadata is only embedded in PNG output, other formats are saved without it.
         """
+        import matplotlib.pyplot as plt
+
         if not output_path:
             new_path = self.file_path.relative_to(self.file_path.parent.parent)
             output_path = pathlib.Path("Output", new_path).with_suffix(file_extension)
@@ -467,23 +602,60 @@ class PolarImage:
 
         output_path.parent.mkdir(parents=True, exist_ok=True)
         fig = self.render(orient=True, toggle_direction=False)
-        img_data = io.BytesIO()
 
-        fig.savefig(img_data, format=file_extension[1:], dpi=300, bbox_inches="tight")
+        # matplotlib writes the metadata as a tEXt chunk, so the PNG is encoded only once
+        image_format = file_extension[1:].lower()
+        if image_format == "png":
+            json_data = json.dumps(self.header, separators=(",", ":"))
+            metadata = {"json_data": json_data}
+        else:
+            metadata = None
+
+        fig.savefig(
+            output_path,
+            format=image_format,
+            dpi=300,
+            bbox_inches="tight",
+            metadata=metadata,
+        )
 
         plt.close(fig)
 
-        img_data.seek(0)
 
-        # Load the image data into PIL
-        img = Image.open(img_data)
+def read_metadata(file_path: str) -> dict:
+    """
+    Reads the header embedded by PolarImage.save_with_metadata() from a PNG file.
+
+    Only the chunk headers are walked, the pixel data is never decoded.
+
+    Args:
+        file_path (str): The path to the PNG file.
+
+    Returns:
+        dict: The embedded header, or an empty dict if none was found.
+    """
+    with open(file_path, "rb") as file:
+        if file.read(8) != b"\x89PNG\r\n\x1a\n":
+            logger.error(f"{file_path} is not a PNG file.")
+            return {}
+
+        while True:
+            chunk_header = file.read(8)
+            if len(chunk_header) < 8:
+                break
+
+            length, chunk_type = struct.unpack(">I4s", chunk_header)
+            if chunk_type == b"IEND":
+                break
 
-        # Prepare a PngInfo object to store textual information
-        metadata = PngImagePlugin.PngInfo()
+            if chunk_type == b"tEXt":
+                keyword, _, text = file.read(length).partition(b"\x00")
+                if keyword == b"json_data":
+                    return json.loads(text.decode("latin1"))
+                length = 0
 
-        json_data = json.dumps(self.header, indent=4)
-        # Add JSON data to the PngInfo object
-        metadata.add_text("json_data", json_data)
+            # Skip the rest of the chunk and its CRC
+            file.seek(length + 4, io.SEEK_CUR)
 
-        # Save the image with the embedded JSON data
-        img.save(output_path, pnginfo=metadata)
+    logger.warning(f"No metadata found in {file_path}.")
+    return {}